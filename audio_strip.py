@@ -1,10 +1,19 @@
 import sys
 import json
+import hashlib
 import subprocess
 import argparse
 import os
 import re
+import shutil
+import signal
+import time
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 
+VERSION = "1.0"
+# Matroska global tag written to every file this script remuxes
+MARKER_TAG = "AUDIO_STRIP"
 
 def format_bytes(size: int, dp: int = 2) -> str:
   '''
@@ -40,6 +49,34 @@ def probe_file(file: str):
   return json.loads(raw)
 
 
+def read_marker(file: str) -> str:
+  '''
+  Read just the processed-marker tag from the file header.
+  Stream detection is cut down to the minimum, so this is much cheaper than probe_file().
+  '''
+  cmd = ["ffprobe", "-v", "quiet", "-probesize", "32", "-analyzeduration", "0",
+         "-show_entries", f"format_tags={MARKER_TAG}", "-of", "default=nw=1:nk=1", file]
+  marker = subprocess.run(cmd, stdout=subprocess.PIPE, text=True).stdout.strip()
+  if DEBUG: print(f"marker : {marker}")
+  return marker
+
+
+def policy_marker() -> str:
+  '''
+  Build the marker value for the current settings: tool name, version and a hash of the policy.
+  A file carrying this exact marker has already been processed with these settings.
+  '''
+  policy = {
+    "languages": sorted(LANGUAGES),
+    "languages_explicit": LANGUAGES_EXPLICIT,
+    "keep": sorted(KEEP_INDEXES),
+    "remove": sorted(REMOVE_INDEXES),
+    "thd": THD,
+  }
+  digest = hashlib.sha1(json.dumps(policy, sort_keys=True).encode()).hexdigest()[:12]
+  return f"audio_strip.py {VERSION} {digest}"
+
+
 def replace_audio_names(name: str) -> str:
   '''
   Convert ffmpeg output to be more human readable. Used primarily for printing out the track list.
@@ -75,7 +112,12 @@ def gen_cmd(infile):
   2.1) OPTIONALLY copy the first audio track to a TrueHD 5.1 stream if it is DTS HD-MA.
   3) OPTIONALLY and by default delete the original file
   '''
-  info = probe_file(infile)
+  # probe through the mergerfs branch if we know it, skipping the FUSE layer
+  probe_path = BRANCH_PATHS.get(infile, infile)
+  if not FORCE and read_marker(probe_path) == MARKER:
+    if DEBUG: print("File already processed with the current settings, skipping.")
+    return [None, None, None, None, None, False, 0]
+  info = probe_file(probe_path)
   streams = info.get("streams")
 
   # Create a set of languages to keep for audio tracks
@@ -173,13 +215,20 @@ def gen_cmd(infile):
   # Determine DTS-HD MA conversion status before filtering
   is_dtshd_ma = THD and len(wanted_indexes) > 1 and 'DTS-HD MA' in wanted_indexes[1][1]
 
-  # Calculate the size of the new TrueHD stream (assumed same as the DTS-HD MA source)
+  # Calculate the size of the new TrueHD stream, either predicted from sample encodes
+  # or assumed same as the DTS-HD MA source
   thd_added_bytes = 0
   if is_dtshd_ma:
     thd_stream = next(s for s in streams if s.get("index") == wanted_indexes[1][0])
     thd_tags = thd_stream.get("tags", {})
     thd_size = match_key(thd_tags, "NUMBER_OF_BYTES") if thd_tags else None
-    if thd_size:
+    predicted = None
+    if PREDICT:
+      duration = float(info.get("format", {}).get("duration") or 0)
+      predicted = predict_thd_size(infile, probe_path, wanted_indexes[1][0], duration)
+    if predicted:
+      thd_added_bytes = predicted
+    elif thd_size:
       thd_added_bytes = int(thd_size)
     else:
       duration = thd_stream.get("duration")
@@ -305,6 +354,10 @@ def gen_cmd(infile):
   if is_dtshd_ma:
     # Apply conversion to the first audio stream in the output (which is now the DTS-HD MA stream)
     cmd += f" -c:a:0 truehd -ac 6 -strict -2 -metadata:s:a:0 Title=\"TrueHD 5.1\""
+  # mark the file as processed so later runs can skip it from a header read
+  cmd += f" -metadata {MARKER_TAG}=\"{MARKER}\""
+  if infile.lower().endswith(".mp4"):
+    cmd += " -movflags +use_metadata_tags"
   cmd += f" \"{infile}\""
   # set the new file timestamp to match the original file
   cmd += f" && touch -r \"{original}\" \"{infile}\""
@@ -314,6 +367,54 @@ def gen_cmd(infile):
   return [cmd, total_saved, total_kept, file_summary, sorted(list(audio_languages_to_keep)), is_dtshd_ma, thd_added_bytes]
 
 
+def predict_thd_size(infile: str, probe_path: str, index: int, duration: float) -> int:
+  '''
+  Predict the size of the TrueHD track that would be made from stream 'index' by encoding a few
+  short segments spread through the file in parallel and extrapolating to the full duration.
+  Results are cached per file and invalidated when the file's size or timestamp changes.
+  '''
+  if duration <= 0:
+    return 0
+  st = os.stat(probe_path)
+  key = f"{infile}:{index}"
+  try:
+    with open(THD_SIZE_CACHE) as f:
+      cache = json.load(f)
+  except (OSError, ValueError):
+    cache = {}
+  cached = cache.get(key)
+  if cached and cached["size"] == st.st_size and cached["mtime"] == st.st_mtime:
+    if DEBUG: print(f"cached THD size prediction: {cached['bytes']}")
+    return cached["bytes"]
+
+  seg = min(SAMPLE_SECONDS, duration / SAMPLE_SEGMENTS)
+  # segment starts evenly spaced through the file, avoiding the very start and end
+  starts = [duration * (i + 1) / (SAMPLE_SEGMENTS + 1) - seg / 2 for i in range(SAMPLE_SEGMENTS)]
+
+  def encode(start):
+    cmd = ["ffmpeg", "-v", "error", "-ss", f"{start:.3f}", "-t", f"{seg:.3f}", "-i", probe_path,
+           "-map", f"0:{index}", "-c:a", "truehd", "-ac", "6", "-strict", "-2", "-f", "truehd", "-"]
+    if DEBUG: print(f"cmd : {cmd}")
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    # a failed or truncated segment would silently shrink the prediction
+    return len(result.stdout) if result.returncode == 0 and result.stdout else None
+
+  with ThreadPoolExecutor(max_workers=SAMPLE_SEGMENTS) as executor:
+    segments = list(executor.map(encode, starts))
+  if None in segments:
+    if DEBUG: print("a sample encode failed, not predicting the THD size")
+    return 0
+  sampled = sum(segments)
+  predicted = int(sampled / (seg * SAMPLE_SEGMENTS) * duration)
+  if DEBUG: print(f"sampled {sampled} bytes from {SAMPLE_SEGMENTS}x{seg:.0f}s, predicted THD size: {predicted}")
+
+  cache[key] = {"size": st.st_size, "mtime": st.st_mtime, "bytes": predicted}
+  os.makedirs(os.path.dirname(THD_SIZE_CACHE), exist_ok=True)
+  with open(THD_SIZE_CACHE, "w") as f:
+    json.dump(cache, f)
+  return predicted
+
+
 def get_files(path):
   '''
   Get all movie files in a given directory
@@ -334,6 +435,257 @@ def get_files(path):
   return results
 
 
+def mergerfs_branches(path: str) -> tuple:
+  '''
+  Find the mount point 'path' lives under and, if it is a mergerfs pool, the branch paths backing it.
+  Branches are read from the pool's '.mergerfs' control file xattrs, or taken from --branches if given.
+  Returns (mount, [branches])
+  '''
+  mount = path
+  while not os.path.ismount(mount):
+    mount = os.path.dirname(mount)
+  if BRANCHES != ["auto"]:
+    return mount, BRANCHES
+  control = os.path.join(mount, ".mergerfs")
+  # 'branches' on current mergerfs, 'srcmounts' on older releases
+  for attr in ("user.mergerfs.branches", "user.mergerfs.srcmounts"):
+    try:
+      raw = os.getxattr(control, attr).decode()
+    except OSError:
+      continue
+    if DEBUG: print(f"{attr} : {raw}")
+    # eg: /srv/dev-disk-by-uuid-1/media=RW:/srv/dev-disk-by-uuid-2/media=RW,100G
+    return mount, [b.split("=", 1)[0] for b in raw.split(":") if b]
+  return mount, []
+
+
+def get_files_branches(path: str) -> dict:
+  '''
+  Get all movie files in a directory on a mergerfs pool by walking every branch directly, one thread per disk.
+  Returns {pool path: branch path}. A file present on several branches is kept from the first branch,
+  matching what mergerfs itself would read.
+  '''
+  pool, branches = mergerfs_branches(path)
+  if not branches:
+    print(f"Warning: no mergerfs branches found for {path}, scanning through the pool instead.")
+    return {f: f for f in get_files(path)}
+  rel = os.path.relpath(path, pool)
+  if DEBUG: print(f"pool: {pool}, relative path: {rel}, branches: {branches}")
+
+  with ThreadPoolExecutor(max_workers=len(branches)) as executor:
+    walks = list(executor.map(lambda b: get_files(os.path.normpath(os.path.join(b, rel))), branches))
+
+  found = {}
+  for branch, branch_files in zip(branches, walks):
+    for f in branch_files:
+      pool_file = os.path.normpath(os.path.join(pool, os.path.relpath(f, branch)))
+      found.setdefault(pool_file, f)
+  if not found:
+    print(f"Warning: no video files found on the mergerfs branches for {path}, scanning through the pool instead.")
+    return {f: f for f in get_files(path)}
+  return found
+
+
+def read_disk_stats() -> dict:
+  '''
+  Read the cumulative read counters of every physical disk from /proc/diskstats.
+  Returns {device: (reads_completed, ms_reading)}
+  '''
+  stats = {}
+  with open("/proc/diskstats") as f:
+    for line in f:
+      fields = line.split()
+      name = fields[2]
+      # partitions, loop devices and device-mapper targets have no 'device' link
+      if not os.path.exists(f"/sys/block/{name}/device"):
+        continue
+      stats[name] = (int(fields[3]), int(fields[6]))
+  return stats
+
+
+def read_latency(before: dict, after: dict) -> float:
+  '''
+  Work out the worst average read latency (ms per read) of any disk between two read_disk_stats() snapshots.
+  Latency is used rather than utilisation, since the running job alone keeps the disks fully busy.
+  '''
+  latency = 0.0
+  for name, (reads, read_ms) in after.items():
+    if name not in before:
+      continue
+    d_reads = reads - before[name][0]
+    if d_reads > 0:
+      latency = max(latency, (read_ms - before[name][1]) / d_reads)
+  return latency
+
+
+def streams_active() -> bool:
+  '''
+  Ask the user supplied --stream-probe command whether anyone is watching something.
+  Exit code 0 means there are active streams.
+  '''
+  return subprocess.run(STREAM_PROBE, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+
+
+def window_remaining(now: datetime) -> float:
+  '''
+  Seconds left in the maintenance window covering 'now', following on through any window that
+  starts exactly where the current one ends (eg: sat and sun). 0 when outside every window.
+  '''
+  remaining = 0.0
+  t = now
+  # a week of back to back windows is effectively always open
+  while remaining < 7 * 86400:
+    end = None
+    for days, start_min, end_min in WINDOWS:
+      # a window wrapping past midnight may have started the day before
+      for offset in (0, -1):
+        day = (t + timedelta(days=offset)).replace(hour=0, minute=0, second=0, microsecond=0)
+        if day.weekday() not in days:
+          continue
+        w_start = day + timedelta(minutes=start_min)
+        w_end = day + timedelta(minutes=end_min if end_min > start_min else end_min + 1440)
+        if w_start <= t < w_end and (end is None or w_end > end):
+          end = w_end
+    if end is None:
+      break
+    remaining += (end - t).total_seconds()
+    t = end
+  return remaining
+
+
+def next_window_start(now: datetime) -> datetime:
+  '''
+  The start of the next maintenance window after 'now'.
+  '''
+  starts = []
+  for days, start_min, end_min in WINDOWS:
+    for offset in range(8):
+      day = (now + timedelta(days=offset)).replace(hour=0, minute=0, second=0, microsecond=0)
+      w_start = day + timedelta(minutes=start_min)
+      if day.weekday() in days and w_start > now:
+        starts.append(w_start)
+  return min(starts)
+
+
+def load_throughput() -> dict:
+  '''
+  Load the bytes/seconds processed by past jobs, kept separately for plain remuxes and THD conversions.
+  '''
+  try:
+    with open(THROUGHPUT_FILE) as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return {}
+
+
+def record_throughput(kind: str, size_bytes: int, seconds: float):
+  '''
+  Add a successfully finished --run job to the throughput history used to predict --window job durations.
+  '''
+  if seconds <= 0:
+    return
+  history = load_throughput()
+  bytes_done, seconds_done = history.get(kind, [0, 0])
+  history[kind] = [bytes_done + size_bytes, seconds_done + seconds]
+  os.makedirs(os.path.dirname(THROUGHPUT_FILE), exist_ok=True)
+  with open(THROUGHPUT_FILE, "w") as f:
+    json.dump(history, f)
+
+
+def predict_duration(kind: str, size_bytes: int) -> float:
+  '''
+  Predict how many seconds a job will take from the file size and past throughput.
+  '''
+  bytes_done, seconds_done = load_throughput().get(kind, [0, 0])
+  rate = bytes_done / seconds_done if seconds_done else DEFAULT_THROUGHPUT[kind]
+  return size_bytes / rate
+
+
+def wait_for_window(predicted: float):
+  '''
+  Block until a maintenance window has enough time left to fit a job predicted to take 'predicted' seconds.
+  A job too long for any window starts as soon as any window is open and is suspended across the gaps.
+  '''
+  longest = max(window_remaining(next_window_start(datetime.now() + timedelta(days=offset)))
+                for offset in range(7))
+  too_long = predicted > longest
+  while True:
+    now = datetime.now()
+    remaining = window_remaining(now)
+    if remaining > 0 and (remaining >= predicted or too_long):
+      return
+    start = next_window_start(now)
+    print(f"Job needs ~{timedelta(seconds=int(predicted))}, {timedelta(seconds=int(remaining))} left in this window. Waiting until {start:%a %H:%M}")
+    time.sleep(max(1, (start - now).total_seconds()))
+
+
+def run_cmd(cmd: str) -> tuple:
+  '''
+  Run a generated command and return (exit code, seconds it spent actually running, not paused).
+  With --throttle the job runs at the lowest best-effort I/O priority. While streams are active it
+  is paused (SIGSTOP) whenever disk reads are more than --max-latency slower than the baseline
+  measured while the job was last paused, and resumed (SIGCONT) after a short break or once the
+  streams have stopped. The first time streams are seen the job is paused to take that baseline.
+  With --window the job is also paused outside the maintenance windows and resumed in the next one.
+  '''
+  started = time.monotonic()
+  if not THROTTLE and not WINDOWS:
+    returncode = subprocess.run(cmd, shell=True).returncode
+    return returncode, time.monotonic() - started
+
+  args = ["sh", "-c", cmd]
+  if THROTTLE and shutil.which("ionice"):
+    args = ["ionice", "-c", "2", "-n", "7"] + args
+  # own process group so the whole mv/ffmpeg/touch chain can be stopped and continued together.
+  # Detached from the terminal's stdin, otherwise ffmpeg in a background group gets stopped by SIGTTOU
+  proc = subprocess.Popen(args, stdin=subprocess.DEVNULL, preexec_fn=os.setpgrp)
+  paused = False
+  paused_at = 0.0
+  paused_total = 0.0
+  # read latency of the disks with the job stopped, only the streams (and other users) reading
+  baseline = None
+  before = read_disk_stats() if THROTTLE else {}
+  try:
+    while proc.poll() is None:
+      time.sleep(POLL_INTERVAL)
+      now = time.monotonic()
+      outside = bool(WINDOWS) and window_remaining(datetime.now()) == 0
+      streaming, latency = False, 0.0
+      if THROTTLE:
+        after = read_disk_stats()
+        latency = read_latency(before, after)
+        before = after
+        streaming = streams_active()
+        if not streaming:
+          baseline = None
+        elif paused:
+          # the job was stopped for this whole sample, so it only reflects everyone else's reads
+          baseline = latency
+        if DEBUG: print(f"throttle: latency {latency:.1f}ms, baseline {baseline}, streaming {streaming}, paused {paused}")
+      measure = streaming and baseline is None
+      slow = streaming and baseline is not None and latency > baseline + MAX_LATENCY
+      if not paused and (outside or measure or slow):
+        os.killpg(proc.pid, signal.SIGSTOP)
+        paused, paused_at = True, now
+        if outside:
+          print(f"\nMaintenance window closed, pausing job until {next_window_start(datetime.now()):%a %H:%M}")
+        elif measure:
+          print("\nStreams started, pausing job to measure disk latency without it")
+        else:
+          print(f"\nDisk reads slowed to {latency:.0f}ms (from {baseline:.0f}ms) while streaming, pausing job")
+      elif paused and not outside and (not streaming or (baseline is not None and now - paused_at >= THROTTLE_MIN_PAUSE)):
+        os.killpg(proc.pid, signal.SIGCONT)
+        paused = False
+        paused_total += now - paused_at
+        print("Resuming job")
+  except KeyboardInterrupt:
+    # the job is in its own process group so pass the interrupt on, making sure it isn't stopped
+    os.killpg(proc.pid, signal.SIGCONT)
+    os.killpg(proc.pid, signal.SIGINT)
+    proc.wait()
+    raise
+  return proc.returncode, time.monotonic() - started - paused_total
+
 if __name__ == '__main__':
   def comma_separated_list(value: str) -> list[str]:
     """Turn 'eng,pol' into ['eng', 'pol'] (stripping spaces, ignoring empties)."""
@@ -351,6 +703,30 @@ if __name__ == '__main__':
       return int(float(value[:-1]) * multipliers[value[-1]])
     return int(value)
 
+  def parse_window(value: str) -> tuple:
+    """Turn 'sat,sun' or '01:00-07:00' or 'mon,fri 22:00-06:00' into (weekday numbers, start minute, end minute)."""
+    days_of_week = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+    if not value.strip():
+      raise argparse.ArgumentTypeError("empty window")
+    days, start_min, end_min = set(range(7)), 0, 1440
+    for part in value.strip().lower().split():
+      if '-' in part:
+        times = re.fullmatch(r"(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})", part)
+        if not times:
+          raise argparse.ArgumentTypeError(f"invalid window times '{part}', expected HH:MM-HH:MM")
+        start_h, start_m, end_h, end_m = (int(t) for t in times.groups())
+        start_min = start_h * 60 + start_m
+        end_min = end_h * 60 + end_m
+        if start_m > 59 or end_m > 59 or start_min > 1440 or end_min > 1440:
+          raise argparse.ArgumentTypeError(f"invalid window times '{part}', expected HH:MM-HH:MM")
+      else:
+        names = [d.strip() for d in part.split(',') if d.strip()]
+        unknown = [d for d in names if d not in days_of_week]
+        if not names or unknown:
+          raise argparse.ArgumentTypeError(f"invalid window days '{part}', expected eg: sat,sun")
+        days = {days_of_week.index(d) for d in names}
+    return (days, start_min, end_min)
+
   parser = argparse.ArgumentParser(prog='audio_strip.py',
                                    description='Remove all unwanted language audio tracks from video files to save space.\nDEFAULT BEHVAIOUR is to DRY-RUN, making no changes.\nRequires ffmpeg installed, ideally version 7.1+ for good TrueHD compatibility (libavcodec 61.19.101 has been used for development)', formatter_class=argparse.RawTextHelpFormatter)
   parser.add_argument('filepaths',
@@ -386,8 +762,35 @@ if __name__ == '__main__':
   parser.add_argument('--minsave',
                       type=parse_size,
                       default='100m',
-                      help='Ignore files where the total space saving is less than this value. Supports suffixes: b, k, m, g. eg: 500m, 1g. Default: 100m')
+                      help='Ignore files where the total space saving is less than this value. Supports suffixes: b, k, m, g. eg: 500m, 1g. Default: 100m\nDTS-HD MA files getting a TrueHD track are always kept, unless --predict is used, then the net saving must reach this too')
+  parser.add_argument('--force',
+                      action='store_true',
+                      help='Re-check files even if they carry a marker showing they were already processed with the same settings')
+  parser.add_argument('--predict',
+                      action='store_true',
+                      help='Predict the size of new TrueHD tracks by encoding a few short samples of the DTS-HD MA track,\ninstead of assuming it is the same size as the source. Results are cached per file in ~/.cache/media_scripts')
+  parser.add_argument('--window',
+                      type=parse_window,
+                      action='append',
+                      default=[],
+                      help='Only run jobs inside this maintenance window. Can be given several times.\nA job only starts if the window has time left for its predicted duration (from file size and past throughput),\nrunning jobs are paused when the window closes and resumed in the next one.\neg: --window 01:00-07:00 --window sat,sun')
+  parser.add_argument('--branches',
+                      type=comma_separated_list,
+                      default=None,
+                      help='Scan a mergerfs pool by walking its underlying branches in parallel and probe files through them, bypassing FUSE.\nGive the branch paths comma-separated, or \'auto\' to read them from the pool. Commands still use the pool paths.\neg: --branches auto')
+  parser.add_argument('--throttle',
+                      action='store_true',
+                      help='Run jobs at low I/O priority and pause them while disk reads are slow and media is being streamed, so playback doesn\'t stutter.\nRequires --stream-probe. Linux only (/proc/diskstats)')
+  parser.add_argument('--stream-probe',
+                      default=None,
+                      help='Shell command used by --throttle to check for active streams. Exit code 0 means something is playing.\neg: --stream-probe \'curl -s "http://localhost:8096/Sessions?api_key=KEY&activeWithinSeconds=60" | grep -q NowPlayingItem\'')
+  parser.add_argument('--max-latency',
+                      type=float,
+                      default=50,
+                      help='How many ms the average disk read latency may rise above the latency measured with the job paused\nbefore --throttle pauses the running job. Default: 50')
   args = parser.parse_args()
+  if args.throttle and not args.stream_probe:
+    parser.error("--throttle requires --stream-probe")
   FILEPATHS = args.filepaths
   if args.languages is None:
     LANGUAGES = ['eng']
@@ -401,6 +804,23 @@ if __name__ == '__main__':
   THD       = args.nothd
   KEEP_INDEXES = args.keep
   REMOVE_INDEXES = args.remove
+  FORCE     = args.force
+  MARKER    = policy_marker()
+  BRANCHES  = args.branches
+  WINDOWS   = args.window
+  PREDICT   = args.predict
+  THD_SIZE_CACHE = os.path.expanduser("~/.cache/media_scripts/thd_sizes.json")
+  SAMPLE_SEGMENTS = 4
+  SAMPLE_SECONDS = 30
+  THROUGHPUT_FILE = os.path.expanduser("~/.cache/media_scripts/throughput.json")
+  # bytes per second assumed before any jobs have been timed
+  DEFAULT_THROUGHPUT = {"copy": 100 * 1024**2, "thd": 20 * 1024**2}
+  BRANCH_PATHS = {}
+  THROTTLE  = args.throttle
+  STREAM_PROBE = args.stream_probe
+  MAX_LATENCY = args.max_latency
+  POLL_INTERVAL = 2
+  THROTTLE_MIN_PAUSE = 10
 
   if not EXECUTE:
     print("\nDRYRUN - NO CHANGES WILL BE MADE. ADD '--run' TO MAKE CHANGES\n")
@@ -417,7 +837,12 @@ if __name__ == '__main__':
   files = []
   for path in FILEPATHS:
     abs_path = os.path.abspath(path)
-    if os.path.isdir(abs_path):
+    if os.path.isdir(abs_path) and BRANCHES:
+      print("Searching for video files in", abs_path, "(recursive, across mergerfs branches)")
+      found = get_files_branches(abs_path)
+      BRANCH_PATHS.update(found)
+      files.extend(found)
+    elif os.path.isdir(abs_path):
       print("Searching for video files in", abs_path, "(recursive)")
       files.extend(get_files(abs_path))
     elif os.path.isfile(abs_path):
@@ -449,6 +874,11 @@ if __name__ == '__main__':
       total_file_size = format_bytes(total_bytes)
       percent_saved = int((saveable_bytes / total_bytes) * 100) if total_bytes else 0
 
+      if PREDICT and net_saved_bytes < MIN_SAVE_BYTES:
+        # with a predicted THD size the net saving is reliable enough to judge conversions too
+        net_str = format_bytes(abs(net_saved_bytes)) + (" saved" if net_saved_bytes >= 0 else " added")
+        print(f"Predicted net change {net_str} is below the minimum saving of {format_bytes(MIN_SAVE_BYTES)}. Skipping {infile.split('/')[-1]}")
+        continue
       if saveable_bytes < MIN_SAVE_BYTES and not is_dtshd_ma:
         if DEBUG: print(f"Saveable space {saveable_space} is less than {format_bytes(MIN_SAVE_BYTES)} and no THD conversion needed. Skipping {infile.split('/')[-1]}")
         continue
@@ -467,7 +897,12 @@ if __name__ == '__main__':
       print("-" * len(out_line))
       print(cmd, "\n")
       if EXECUTE:
-        subprocess.run(cmd, shell=True)
+        kind = "thd" if is_dtshd_ma else "copy"
+        if WINDOWS:
+          wait_for_window(predict_duration(kind, total_bytes))
+        returncode, seconds = run_cmd(cmd)
+        if returncode == 0:
+          record_throughput(kind, total_bytes, seconds)
         print("Done\n")
 
   if not breakdown:
@@ -1,10 +1,24 @@
 import sys
 import json
+import hashlib
 import subprocess
 import argparse
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 
+VERSION = "1.0"
+# Matroska global tag written to every file this script remuxes
+MARKER_TAG = "THD_PY"
+# ffmpeg settings for the new TrueHD track, also hashed into the processed-marker
+THD_ARGS = (
+  # Convert the first mapped audio stream (our new track) to TrueHD
+  "-c:a:0 truehd -ac 6 -strict -2 -metadata:s:a:0 title=\"TrueHD 5.1\""
+  # Set the new TrueHD track as the default audio stream
+  " -disposition:a:0 default"
+  # Set the original default audio stream to not be default anymore
+  " -disposition:a:1 0"
+)
 
 def format_bytes(bytes:int, dp:int=2) -> list:
   '''
@@ -42,6 +56,25 @@ def probe_file(file: str):
   return info
 
 
+def read_marker(file: str) -> str:
+  '''
+  Read just the processed-marker tag from the file header.
+  Stream detection is cut down to the minimum, so this is much cheaper than probe_file().
+  '''
+  cmd = f"ffprobe -v quiet -probesize 32 -analyzeduration 0 -show_entries format_tags={MARKER_TAG} -of default=nw=1:nk=1 \"{file}\""
+  marker = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, text=True).stdout.strip()
+  if DEBUG: print(f"marker : {marker}")
+  return marker
+
+
+def policy_marker() -> str:
+  '''
+  Build the marker value: tool name, version and a hash of the TrueHD conversion settings.
+  '''
+  digest = hashlib.sha1(THD_ARGS.encode()).hexdigest()[:12]
+  return f"thd.py {VERSION} {digest}"
+
+
 def replace_audio_names(name:str) -> str:
   '''
   Convert ffmpeg output to be more human readable. Used primarily for printing out the track list.
@@ -78,6 +111,10 @@ def gen_cmd(infile):
   2) use ffmpeg to create a new file with an added TrueHD track from the first DTS-HD MA track.
   3) OPTIONALLY and by default delete the original file
   '''
+  if not FORCE and read_marker(infile) == MARKER:
+    if DEBUG: print("File already processed with the current settings, skipping.")
+    return [None, [], 0]
+
   info = probe_file(infile)
   streams = info.get("streams")
 
@@ -137,10 +174,16 @@ def gen_cmd(infile):
       if DEBUG:
           if not dts_hd_ma_stream: print("No DTS-HD MA track found for conversion.")
           if has_truehd: print("File already contains a TrueHD track.")
-      return [None, file_summary]
+      return [None, file_summary, 0]
 
   dts_index = dts_hd_ma_stream.get("index")
 
+  # Optionally predict the size of the new TrueHD track from a few sample encodes
+  thd_bytes = 0
+  if PREDICT:
+    duration = float(info.get("format", {}).get("duration") or 0)
+    thd_bytes = predict_thd_size(infile, dts_index, duration)
+
   # Build the ffmpeg command
   cmd   =   f"mv \"{infile}\" \"{infile}.original\""
   cmd   +=  f" && ffmpeg -hide_banner -loglevel error -stats -i \"{infile}.original\""
@@ -156,17 +199,63 @@ def gen_cmd(infile):
   cmd   +=  f" -map 0:s?"
   # Copy all streams except the new audio track
   cmd   +=  f" -c copy"
-  # Convert the first mapped audio stream (our new track) to TrueHD
-  cmd   +=  f" -c:a:0 truehd -ac 6 -strict -2 -metadata:s:a:0 title=\"TrueHD 5.1\""
-  # Set the new TrueHD track as the default audio stream
-  cmd   +=  f" -disposition:a:0 default"
-  # Set the original default audio stream to not be default anymore
-  cmd   +=  f" -disposition:a:1 0"
+  # Convert the first mapped audio stream to TrueHD and make it the default
+  cmd   +=  f" {THD_ARGS}"
+  # Mark the file as processed so later runs can skip it from a header read
+  cmd   +=  f" -metadata {MARKER_TAG}=\"{MARKER}\""
+  if infile.lower().endswith(".mp4"): cmd += f" -movflags +use_metadata_tags"
   cmd   +=  f" \"{infile}\""
   cmd   +=  f" && touch -r \"{infile}.original\" \"{infile}\""
   if not NODEL: cmd +=  f" && rm \"{infile}.original\""
 
-  return [cmd, file_summary]
+  return [cmd, file_summary, thd_bytes]
+
+
+def predict_thd_size(infile: str, index: int, duration: float) -> int:
+  '''
+  Predict the size of the TrueHD track that would be made from stream 'index' by encoding a few
+  short segments spread through the file in parallel and extrapolating to the full duration.
+  Results are cached per file and invalidated when the file's size or timestamp changes.
+  '''
+  if duration <= 0:
+    return 0
+  st = os.stat(infile)
+  key = f"{infile}:{index}"
+  try:
+    with open(THD_SIZE_CACHE) as f:
+      cache = json.load(f)
+  except (OSError, ValueError):
+    cache = {}
+  cached = cache.get(key)
+  if cached and cached["size"] == st.st_size and cached["mtime"] == st.st_mtime:
+    if DEBUG: print(f"cached THD size prediction: {cached['bytes']}")
+    return cached["bytes"]
+
+  seg = min(SAMPLE_SECONDS, duration/SAMPLE_SEGMENTS)
+  # segment starts evenly spaced through the file, avoiding the very start and end
+  starts = [duration*(i+1)/(SAMPLE_SEGMENTS+1) - seg/2 for i in range(SAMPLE_SEGMENTS)]
+
+  def encode(start):
+    cmd = f"ffmpeg -v error -ss {start:.3f} -t {seg:.3f} -i \"{infile}\" -map 0:{index} -c:a truehd -ac 6 -strict -2 -f truehd -"
+    if DEBUG: print(f"cmd : {cmd}")
+    result = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    # a failed or truncated segment would silently shrink the prediction
+    return len(result.stdout) if result.returncode == 0 and result.stdout else None
+
+  with ThreadPoolExecutor(max_workers=SAMPLE_SEGMENTS) as executor:
+    segments = list(executor.map(encode, starts))
+  if None in segments:
+    if DEBUG: print("a sample encode failed, not predicting the THD size")
+    return 0
+  sampled = sum(segments)
+  predicted = int(sampled/(seg*SAMPLE_SEGMENTS)*duration)
+  if DEBUG: print(f"sampled {sampled} bytes from {SAMPLE_SEGMENTS}x{seg:.0f}s, predicted THD size: {predicted}")
+
+  cache[key] = {"size": st.st_size, "mtime": st.st_mtime, "bytes": predicted}
+  os.makedirs(os.path.dirname(THD_SIZE_CACHE), exist_ok=True)
+  with open(THD_SIZE_CACHE, "w") as f:
+    json.dump(cache, f)
+  return predicted
 
 
 def get_files(path):
@@ -216,11 +305,23 @@ if __name__ == '__main__':
   parser.add_argument('--nodel',
                       action='store_true',
                       help='Set this to not delete the original video and just keep it with a .original appendix')
+  parser.add_argument('--predict',
+                      action='store_true',
+                      help='Predict the size of each new TrueHD track by encoding a few short samples of the DTS-HD MA track. Results are cached per file in ~/.cache/media_scripts')
+  parser.add_argument('--force',
+                      action='store_true',
+                      help='Re-check files even if they carry a marker showing they were already processed')
   args = parser.parse_args()
   FILEPATHS = args.filepaths
   EXECUTE   = args.run
   DEBUG     = args.debug
   NODEL     = args.nodel
+  FORCE     = args.force
+  PREDICT   = args.predict
+  THD_SIZE_CACHE = os.path.expanduser("~/.cache/media_scripts/thd_sizes.json")
+  SAMPLE_SEGMENTS = 4
+  SAMPLE_SECONDS = 30
+  MARKER    = policy_marker()
 
   if not EXECUTE:
     print("\nDRYRUN - NO CHANGES WILL BE MADE. ADD '--run' TO MAKE CHANGES\n")
@@ -251,16 +352,19 @@ if __name__ == '__main__':
 
   print()
   modified_files = []
+  total_thd_bytes = 0
   for infile in files:
     if DEBUG: print("infile : ", infile)
-    cmd, file_summary = gen_cmd(infile)
+    cmd, file_summary, thd_bytes = gen_cmd(infile)
     if cmd is not None:
       modified_files.append(infile)
+      total_thd_bytes += thd_bytes
       print("\n--------------------------------------------------------------------------------")
       print(f"File to modify: {infile}")
       for fs in file_summary:
         print(fs)
       out_line = f"A new TrueHD 5.1 track will be created and set as default."
+      if thd_bytes: out_line += f"  Predicted size: +{format_bytes(thd_bytes)}"
       print(out_line)
       print("-"*len(out_line))
       print(cmd, "\n")
@@ -275,4 +379,5 @@ if __name__ == '__main__':
       print(f)
     action = "modified" if EXECUTE else "to be modified"
     print(f"\nTotal files {action}: {len(modified_files)}")
+    if total_thd_bytes: print(f"Predicted space added : {format_bytes(total_thd_bytes)}")
 